@@ -1,10 +1,19 @@
-from flask import Flask, request, jsonify, render_template, redirect, session, send_file
+from flask import (Flask, request, jsonify, render_template, redirect, session, send_file, g,
+                   has_request_context, Response, stream_with_context)
 from flask_cors import CORS
-from datetime import datetime, timedelta
-from scheduler import solve_shift_schedule
-import sqlite3
-import pandas as pd
+from cachetools import cached, TTLCache
+from werkzeug.security import generate_password_hash, check_password_hash
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from scheduler import solve_shift_schedule, SolverTimeout
 import io
+import os
+import queue
+import sqlite3
+import threading
+import orjson
+import xlsxwriter
 
 # =============================================================================
 # App setup
@@ -14,35 +23,180 @@ app = Flask(__name__)
 CORS(app)
 app.secret_key = "change-me-please"
 
+def ojson(obj, status=200):
+    """JSON response encoded with orjson (fast, Hebrew kept as UTF-8)."""
+    return app.response_class(orjson.dumps(obj), status=status, mimetype='application/json')
+
+
+# =============================================================================
+# Week layout (display order of days / shift slots)
+# =============================================================================
+
+DAY_ORDER  = ('ראשון', 'שני', 'שלישי', 'רביעי', 'חמישי', 'שישי', 'שבת')
+TIME_ORDER = ('בוקר', 'צהריים', 'ערב', 'לילה')   # also the default shift types
+
+# solver inputs that don't vary per request
+HEAVY_SLOTS = frozenset({'בוקר', 'צהריים'})   # slots staffed by 2 workers
+MAX_SHIFTS_PER_WEEK = 20
+
+def _rank_case(column, labels):
+    """SQL CASE giving each label its display position; unknown labels sort last."""
+    whens = " ".join(f"WHEN '{label}' THEN {i}" for i, label in enumerate(labels))
+    return f"CASE {column} {whens} ELSE 999 END"
+
+DAY_CASE  = _rank_case('c.day', DAY_ORDER)
+TIME_CASE = _rank_case('c.time', TIME_ORDER)
+SHIFT_DAY_CASE  = _rank_case('s.day', DAY_ORDER)
+SHIFT_TIME_CASE = _rank_case('s.time', TIME_ORDER)
+
 
 # =============================================================================
 # DB helpers
 # =============================================================================
 
-def connect():
-    """Open SQLite with FK enforcement ON for this connection + Row dicts."""
-    conn = sqlite3.connect('schedule.db')
-    conn.execute('PRAGMA foreign_keys = ON')
+DB_PATH = 'schedule.db'
+READER_POOL_SIZE = max(4, os.cpu_count() or 4)  # readers scale with cores
+POOL_TIMEOUT = 10  # seconds to wait for a free connection before giving up (503)
+
+# One dedicated writer + N readers (WAL lets readers run alongside the writer)
+_READERS = queue.LifoQueue(maxsize=READER_POOL_SIZE)
+_WRITER = queue.LifoQueue(maxsize=1)
+_pool_lock = threading.RLock()  # re-entered by init_db/upgrade_db while migrating
+_pool_filled = False
+_pool_ready = False
+_migrating = False
+
+_CONN_PRAGMAS = """
+    PRAGMA journal_mode = WAL;
+    PRAGMA synchronous = NORMAL;
+    PRAGMA temp_store = MEMORY;
+    PRAGMA cache_size = -64000;
+    PRAGMA mmap_size = 268435456;
+    PRAGMA foreign_keys = ON;
+"""
+
+def _open_connection():
+    """Open SQLite with the tuning PRAGMAs, FK enforcement ON + Row dicts."""
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, cached_statements=256)
+    conn.executescript(_CONN_PRAGMAS)
     conn.row_factory = sqlite3.Row
     return conn
 
+def _fill_pool():
+    """Pre-open the pooled connections and migrate the schema, once per process.
+
+    Runs on the first get_conn() of any entry point (app.py, run.py, a WSGI server),
+    so no query ever sees a DB older than SCHEMA_VERSION. Other threads wait on the
+    lock until the migration is done.
+    """
+    global _pool_filled, _pool_ready, _migrating
+    if _pool_ready:
+        return
+    with _pool_lock:
+        if _pool_ready or _migrating:
+            return
+        if not _pool_filled:
+            writer = _open_connection()
+            writer.execute("ANALYZE")  # fresh planner stats for this process's lifetime
+            writer.commit()
+            _WRITER.put(writer)
+            for _ in range(READER_POOL_SIZE):
+                _READERS.put(_open_connection())
+            _pool_filled = True
+        _migrating = True
+        try:
+            init_db()
+            upgrade_db()
+        finally:
+            _migrating = False
+        _pool_ready = True
+
+class PoolTimeout(Exception):
+    """No pooled connection became free within POOL_TIMEOUT."""
+
+def _acquire(pool):
+    try:
+        return pool.get(timeout=POOL_TIMEOUT)
+    except queue.Empty:
+        raise PoolTimeout() from None
+
+def _release(pool, conn):
+    """Give a connection back to its pool without a dangling transaction."""
+    if conn.in_transaction:
+        conn.rollback()
+    if pool is _WRITER:
+        # only the writer changes data, so it keeps the planner stats current
+        # (running it on readers would make them compete for the write lock)
+        try:
+            conn.execute("PRAGMA optimize")
+        except sqlite3.OperationalError:
+            pass
+    pool.put(conn)
+
+@contextmanager
+def get_conn(write=False):
+    """Borrow a pooled connection.
+
+    Reads (the default) take a reader that stays on `g` until teardown, so helpers
+    called from the same handler share it. write=True borrows the single writer
+    for the `with` block only – keep slow work (solver, password hashing) outside
+    it. Inside a write block nested get_conn() calls reuse the writer. Outside a
+    request (init/upgrade) the writer is used.
+    """
+    _fill_pool()
+    in_request = has_request_context()
+    if in_request and 'db_writer' in g:
+        yield g.db_writer
+        return
+
+    if write or not in_request:
+        conn = _acquire(_WRITER)
+        if in_request:
+            g.db_writer = conn
+        try:
+            yield conn
+        finally:
+            if in_request:
+                g.pop('db_writer', None)
+            _release(_WRITER, conn)
+        return
+
+    if 'db_conn' not in g:
+        g.db_conn = _acquire(_READERS)
+    yield g.db_conn
+
+@app.teardown_appcontext
+def _return_conn(exc):
+    conn = g.pop('db_conn', None)
+    if conn is not None:
+        _release(_READERS, conn)
+
+@app.errorhandler(PoolTimeout)
+def _pool_timeout(exc):
+    return jsonify({"message": "השרת עמוס כרגע, נסו שוב בעוד רגע"}), 503
+
+def _next_worker_id(c):
+    """Claim the next worker_id; run inside the same transaction as the INSERT."""
+    row = c.execute("UPDATE seq SET val = val + 1 WHERE name = 'worker' RETURNING val").fetchone()
+    if row is None:
+        raise RuntimeError("seq row 'worker' is missing – upgrade_db() seeds it (schema v4)")
+    return str(row[0])
+
 def get_company_id_from_request():
-    """Priority: session -> querystring -> JSON body."""
-    cid = session.get('company_id')
-    if cid:
-        return cid
-    cid = request.args.get('company_id')
+    """Priority: session -> querystring -> JSON body (parsed only if it is JSON)."""
+    cid = session.get('company_id') or request.args.get('company_id')
     if cid:
         return cid
-    data = request.get_json(silent=True) or {}
-    return data.get('company_id')
+    if request.is_json:
+        return (request.get_json(silent=True) or {}).get('company_id')
+    return None
 
+@cached(TTLCache(maxsize=1024, ttl=60), lock=threading.Lock())
 def _get_company_id_for_manager(manager_id: str):
-    """Bring company_id for a manager, or None."""
+    """Bring company_id for a manager, or None (cached 60s; cleared by delete_worker)."""
     if not manager_id:
         return None
-    conn = connect()
-    try:
+    with get_conn() as conn:
         c = conn.cursor()
         c.execute(
             "SELECT company_id FROM workers WHERE worker_id = ? AND role = 'manager'",
@@ -50,207 +204,385 @@ def _get_company_id_for_manager(manager_id: str):
         )
         row = c.fetchone()
         return row[0] if row and row[0] is not None else None
-    finally:
-        conn.close()
 
 
 # =============================================================================
-# DB init + upgrade (with FK CASCADE migration for constraints)
+# Hot-path SQL (shared constants, served from the statement cache)
 # =============================================================================
 
-def init_db():
-    conn = connect()
-    c = conn.cursor()
-
-    # shifts
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS shifts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            day TEXT,
-            time TEXT,
-            employee TEXT,
-            week TEXT,
-            company_id INTEGER
-        )
-    ''')
-
-    # workers
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS workers (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            password TEXT,
-            role TEXT,
-            worker_id TEXT,
-            id_number TEXT,
-            phone TEXT,
-            email TEXT,
-            company_id INTEGER,
-            company_name TEXT
-        )
-    ''')
-
-    # constraints (new table includes FK; upgrade_db will rebuild older ones)
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS constraints (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            worker_id TEXT NOT NULL,
-            day TEXT,
-            time TEXT,
-            FOREIGN KEY (worker_id) REFERENCES workers(worker_id) ON DELETE CASCADE
-        )
-    ''')
-
-    # messages
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            worker_id TEXT,
-            content TEXT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-
-    # attendance
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS attendance (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            worker_id TEXT,
-            check_in TEXT,
-            check_out TEXT
-        )
-    ''')
-
-    # shift_times (optional)
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS shift_times (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            worker_id TEXT,
-            check_in TEXT,
-            check_out TEXT
-        )
-    ''')
+_SQL_LOGIN_MANAGER = """
+    SELECT worker_id, name, company_id, company_name, password
+    FROM workers
+    WHERE worker_id = ? AND role = 'manager'
+"""
+
+_SQL_LOGIN_WORKER = """
+    SELECT password, company_id, company_name, name
+    FROM workers
+    WHERE worker_id = ? AND role = 'worker'
+"""
+
+_SQL_GET_WORKERS = """
+    SELECT worker_id, name, role, id_number, phone, email, company_id
+    FROM workers
+    WHERE company_id = ?
+    ORDER BY worker_id_int
+"""
+
+_SQL_VIEW_CONSTRAINTS = f"""
+    SELECT c.worker_id, w.name, c.day, c.time
+    FROM constraints AS c
+    JOIN workers    AS w ON c.worker_id = w.worker_id
+    WHERE w.company_id = ?
+    ORDER BY {DAY_CASE}, {TIME_CASE}, w.name
+"""
+
+# INNER JOIN + plain company filter: the planner drives from the workers company index
+# into idx_messages_worker_flags_*; an OR'd "(:cid IS NULL OR ...)" would force a scan
+_SQL_GET_MESSAGES_COMPANY = """
+    SELECT m.id, m.worker_id, m.content, m.timestamp, COALESCE(w.name, 'לא ידוע') AS name,
+           m.is_read, m.is_deleted
+    FROM messages m
+    JOIN workers w ON w.worker_id = m.worker_id
+    WHERE w.company_id = :cid AND m.is_deleted = 0 AND (:all = 1 OR m.is_read = 0)
+    ORDER BY m.timestamp DESC
+"""
+
+# LEFT JOIN so messages from removed workers still show up
+_SQL_GET_MESSAGES_ALL = """
+    SELECT m.id, m.worker_id, m.content, m.timestamp, COALESCE(w.name, 'לא ידוע') AS name,
+           m.is_read, m.is_deleted
+    FROM messages m
+    LEFT JOIN workers w ON m.worker_id = w.worker_id
+    WHERE m.is_deleted = 0 AND (:all = 1 OR m.is_read = 0)
+    ORDER BY m.timestamp DESC
+"""
+
+_SQL_VIEW_SCHEDULE = f"""
+    SELECT s.employee AS worker_id, w.name, s.day, s.time
+    FROM shifts s
+    JOIN workers w ON s.employee = w.worker_id
+    WHERE s.week = ? AND s.company_id = ?
+    ORDER BY {SHIFT_DAY_CASE}, {SHIFT_TIME_CASE}, s.id
+"""
+
+_SQL_INSERT_SHIFT = """
+    INSERT INTO shifts (day, time, employee, week, company_id) VALUES (?, ?, ?, ?, ?)
+"""
+
+# separate statements so the company filter can drive the join through the workers index
+_SQL_GET_ATTENDANCE_COMPANY = """
+    SELECT w.worker_id, w.name, a.check_in, a.check_out
+    FROM attendance a
+    JOIN workers w ON a.worker_id = w.worker_id
+    WHERE w.company_id = ?
+    ORDER BY a.check_in DESC
+"""
+
+_SQL_GET_ATTENDANCE_ALL = """
+    SELECT w.worker_id, w.name, a.check_in, a.check_out
+    FROM attendance a
+    JOIN workers w ON a.worker_id = w.worker_id
+    ORDER BY a.check_in DESC
+"""
+
+_SQL_GET_MY_MESSAGES = """
+    SELECT id, content, timestamp
+    FROM messages
+    WHERE worker_id = ? AND is_read = 0 AND is_deleted = 0
+    ORDER BY id DESC
+"""
+
+_SQL_CHECK_IN = """
+    INSERT INTO attendance (worker_id, check_in)
+    VALUES (?, datetime('now', 'localtime'))
+    RETURNING check_in
+"""
+
+# close the latest open shift in one statement
+_SQL_CHECK_OUT = """
+    UPDATE attendance SET check_out = datetime('now', 'localtime')
+    WHERE id = (
+        SELECT id FROM attendance
+        WHERE worker_id = ? AND check_out IS NULL
+        ORDER BY check_in DESC LIMIT 1
+    )
+    RETURNING id
+"""
 
-    # companies
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS companies (
-            company_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            company_name TEXT NOT NULL UNIQUE
-        )
-    ''')
+_SQL_MY_SHIFTS = "SELECT check_in, check_out FROM attendance WHERE worker_id = ?"
 
-    # shift_types
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS shift_types (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL
-        )
-    ''')
+# generate_schedule inputs / week replacement
+_SQL_COMPANY_WORKER_IDS = """
+    SELECT worker_id
+    FROM workers
+    WHERE role = 'worker' AND company_id = ?
+"""
 
-    # default companies
-    count = c.execute("SELECT COUNT(*) FROM companies").fetchone()[0]
-    if count == 0:
-        c.executemany(
-            "INSERT INTO companies (company_name) VALUES (?)",
-            [('מסעדה',), ('שמירה',), ('בית חולים',)]
-        )
+_SQL_COMPANY_CONSTRAINTS = """
+    SELECT c.worker_id, c.day, c.time
+    FROM constraints AS c
+    JOIN workers    AS w ON c.worker_id = w.worker_id
+    WHERE w.company_id = ?
+"""
 
-    # default manager (company 1)
-    exists = c.execute("SELECT 1 FROM workers WHERE role='manager' AND worker_id='10' LIMIT 1").fetchone()
-    if not exists:
-        c.execute("""
-            INSERT INTO workers (name, password, role, worker_id, company_id, company_name)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, ("adam", "4324", "manager", "10", 1, 'מסעדה'))
+_SQL_DELETE_WEEK_SHIFTS = "DELETE FROM shifts WHERE week = ? AND company_id = ?"
 
-    conn.commit()
-    conn.close()
+_SQL_WEEK_SHIFTS = "SELECT employee, day, time FROM shifts WHERE week = ? AND company_id = ?"
 
 
-def upgrade_db():
-    """Add columns/indexes safely and rebuild constraints with FK CASCADE if needed."""
-    conn = connect()
-    c = conn.cursor()
-
-    # workers: add columns if missing
-    for col, typ in {
-        "id_number": "TEXT",
-        "phone": "TEXT",
-        "email": "TEXT",
-        "company_id": "TEXT",
-        "company_name": "TEXT",
-    }.items():
-        try:
-            c.execute(f"ALTER TABLE workers ADD COLUMN {col} {typ}")
-        except sqlite3.OperationalError:
-            pass
+# =============================================================================
+# DB init + upgrade (with FK CASCADE migration for constraints)
+# =============================================================================
 
-    # shifts: add columns if missing
-    for col, typ in {"company_id": "TEXT", "week": "TEXT"}.items():
-        try:
-            c.execute(f"ALTER TABLE shifts ADD COLUMN {col} {typ}")
-        except sqlite3.OperationalError:
-            pass
+def init_db():
+    with get_conn() as conn:
+        c = conn.cursor()
 
-    # messages: add flags if missing
-    try: c.execute("ALTER TABLE messages ADD COLUMN is_read INTEGER DEFAULT 0")
-    except sqlite3.OperationalError: pass
-    try: c.execute("ALTER TABLE messages ADD COLUMN is_deleted INTEGER DEFAULT 0")
-    except sqlite3.OperationalError: pass
-    c.execute("UPDATE messages SET is_read=0 WHERE is_read IS NULL")
-    c.execute("UPDATE messages SET is_deleted=0 WHERE is_deleted IS NULL")
-
-    # indexes
-    c.execute("CREATE INDEX IF NOT EXISTS idx_workers_company_id ON workers(company_id)")
-    c.execute("CREATE INDEX IF NOT EXISTS idx_workers_role_company ON workers(role, company_id)")
-    c.execute("CREATE INDEX IF NOT EXISTS idx_shifts_week_company ON shifts(week, company_id)")
-    c.execute("CREATE INDEX IF NOT EXISTS idx_messages_worker ON messages(worker_id)")
-    c.execute("CREATE INDEX IF NOT EXISTS idx_messages_flags ON messages(is_read, is_deleted)")
-
-    # one-time migration: ensure constraints has FK with CASCADE
-        # ---- ONE-TIME MIGRATION: rebuild constraints with FK + CASCADE ----
-    try:
-        # Check if constraints already has a foreign key defined
-        has_fk = False
-        for _ in c.execute("PRAGMA foreign_key_list(constraints)"):
-            has_fk = True
-            break
-
-        if not has_fk:
-            # Finish any implicit transaction before we do manual DDL
-            conn.commit()
+        # shifts
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS shifts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                day TEXT,
+                time TEXT,
+                employee TEXT,
+                week TEXT,
+                company_id INTEGER
+            )
+        ''')
+
+        # workers
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS workers (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                password TEXT,
+                role TEXT,
+                worker_id TEXT,
+                id_number TEXT,
+                phone TEXT,
+                email TEXT,
+                company_id INTEGER,
+                company_name TEXT
+            )
+        ''')
+
+        # constraints (new table includes FK; upgrade_db will rebuild older ones)
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS constraints (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                worker_id TEXT NOT NULL,
+                day TEXT,
+                time TEXT,
+                FOREIGN KEY (worker_id) REFERENCES workers(worker_id) ON DELETE CASCADE
+            )
+        ''')
+
+        # messages
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                worker_id TEXT,
+                content TEXT,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        # attendance
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS attendance (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                worker_id TEXT,
+                check_in TEXT,
+                check_out TEXT
+            )
+        ''')
+
+        # shift_times (optional)
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS shift_times (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                worker_id TEXT,
+                check_in TEXT,
+                check_out TEXT
+            )
+        ''')
+
+        # companies
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS companies (
+                company_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                company_name TEXT NOT NULL UNIQUE
+            )
+        ''')
+
+        # shift_types
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS shift_types (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL
+            )
+        ''')
+
+        # seq (named id counters, e.g. 'worker'; seeded by upgrade_db)
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS seq (
+                name TEXT PRIMARY KEY,
+                val INTEGER NOT NULL
+            )
+        ''')
+
+        # default companies
+        count = c.execute("SELECT COUNT(*) FROM companies").fetchone()[0]
+        if count == 0:
+            c.executemany(
+                "INSERT INTO companies (company_name) VALUES (?)",
+                [('מסעדה',), ('שמירה',), ('בית חולים',)]
+            )
+
+        # default manager (company 1)
+        exists = c.execute("SELECT 1 FROM workers WHERE role='manager' AND worker_id='10' LIMIT 1").fetchone()
+        if not exists:
+            c.execute("""
+                INSERT INTO workers (name, password, role, worker_id, company_id, company_name)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, ("adam", generate_password_hash("4324"), "manager", "10", 1, 'מסעדה'))
 
-            # Temporarily disable FK checks during table rebuild
-            c.execute("PRAGMA foreign_keys=OFF")
-
-            # Do the rebuild in one script (no nested BEGIN)
-            c.executescript("""
-                CREATE TABLE IF NOT EXISTS constraints_new (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    worker_id TEXT NOT NULL,
-                    day TEXT,
-                    time TEXT,
-                    FOREIGN KEY (worker_id) REFERENCES workers(worker_id) ON DELETE CASCADE
-                );
-
-                INSERT INTO constraints_new (id, worker_id, day, time)
-                SELECT c.id, c.worker_id, c.day, c.time
-                FROM constraints c
-                WHERE EXISTS (SELECT 1 FROM workers w WHERE w.worker_id = c.worker_id);
+        conn.commit()
+
+
+SCHEMA_VERSION = 8
+
+def _add_missing_columns(c, table, columns):
+    """ALTER TABLE ADD COLUMN for each column the table does not have yet."""
+    existing = {row[1] for row in c.execute(f"PRAGMA table_info({table})")}
+    for col, typ in columns.items():
+        if col not in existing:
+            c.execute(f"ALTER TABLE {table} ADD COLUMN {col} {typ}")
 
-                DROP TABLE constraints;
-                ALTER TABLE constraints_new RENAME TO constraints;
-                CREATE INDEX IF NOT EXISTS idx_constraints_worker ON constraints(worker_id);
+
+def upgrade_db():
+    """Apply the migrations newer than the DB's PRAGMA user_version."""
+    with get_conn() as conn:
+        c = conn.cursor()
+        version = c.execute("PRAGMA user_version").fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            return
+
+        if version < 1:
+            # workers / shifts / messages: add columns if missing
+            _add_missing_columns(c, "workers", {
+                "id_number": "TEXT",
+                "phone": "TEXT",
+                "email": "TEXT",
+                "company_id": "TEXT",
+                "company_name": "TEXT",
+            })
+            _add_missing_columns(c, "shifts", {"company_id": "TEXT", "week": "TEXT"})
+            _add_missing_columns(c, "messages", {
+                "is_read": "INTEGER DEFAULT 0",
+                "is_deleted": "INTEGER DEFAULT 0",
+            })
+            c.execute("UPDATE messages SET is_read=0 WHERE is_read IS NULL")
+            c.execute("UPDATE messages SET is_deleted=0 WHERE is_deleted IS NULL")
+
+            # workers: hash any password still stored in plaintext (hashes are longer)
+            plain = c.execute(
+                "SELECT id, password FROM workers WHERE password IS NOT NULL AND length(password) < 60"
+            ).fetchall()
+            c.executemany(
+                "UPDATE workers SET password = ? WHERE id = ?",
+                [(generate_password_hash(r[1]), r[0]) for r in plain]
+            )
+
+            # indexes
+            c.execute("CREATE INDEX IF NOT EXISTS idx_workers_company_id ON workers(company_id)")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_workers_role_company ON workers(role, company_id)")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_shifts_week_company ON shifts(week, company_id)")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_messages_worker ON messages(worker_id)")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_messages_flags ON messages(is_read, is_deleted)")
+
+        if version < 2:
+            # rebuild constraints with FK + CASCADE (tables from init_db already have it)
+            has_fk = c.execute("PRAGMA foreign_key_list(constraints)").fetchone() is not None
+            if not has_fk:
+                # Finish any implicit transaction before we do manual DDL
+                conn.commit()
+
+                # Temporarily disable FK checks during table rebuild
+                c.execute("PRAGMA foreign_keys=OFF")
+
+                # Do the rebuild in one script (no nested BEGIN)
+                c.executescript("""
+                    CREATE TABLE IF NOT EXISTS constraints_new (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        worker_id TEXT NOT NULL,
+                        day TEXT,
+                        time TEXT,
+                        FOREIGN KEY (worker_id) REFERENCES workers(worker_id) ON DELETE CASCADE
+                    );
+
+                    INSERT INTO constraints_new (id, worker_id, day, time)
+                    SELECT c.id, c.worker_id, c.day, c.time
+                    FROM constraints c
+                    WHERE EXISTS (SELECT 1 FROM workers w WHERE w.worker_id = c.worker_id);
+
+                    DROP TABLE constraints;
+                    ALTER TABLE constraints_new RENAME TO constraints;
+                    CREATE INDEX IF NOT EXISTS idx_constraints_worker ON constraints(worker_id);
+                """)
+
+                conn.commit()
+                c.execute("PRAGMA foreign_keys=ON")
+
+        if version < 3:
+            # covering indexes for the JOIN + ORDER BY paths (created after the
+            # rebuild above, which would drop indexes on the old constraints table)
+            c.execute("CREATE INDEX IF NOT EXISTS idx_attendance_worker_checkin ON attendance(worker_id, check_in DESC)")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_messages_worker_flags_ts ON messages(worker_id, is_deleted, is_read, timestamp DESC)")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_constraints_worker_day_time ON constraints(worker_id, day, time)")
+
+            # refresh planner statistics so the new indexes get picked up
+            c.execute("ANALYZE")
+
+        if version < 4:
+            # seed the worker_id counter from the ids handed out so far
+            c.execute("""
+                INSERT OR IGNORE INTO seq (name, val)
+                SELECT 'worker', COALESCE(MAX(CAST(worker_id AS INTEGER)), 9) FROM workers
             """)
 
-            conn.commit()
-            c.execute("PRAGMA foreign_keys=ON")
-    except sqlite3.OperationalError:
-        # Fresh DB or older schema edge-cases: safe to ignore
-        pass
+        if version < 5:
+            # per-worker inbox reads order by id (insertion order), so end the index on it
+            c.execute("CREATE INDEX IF NOT EXISTS idx_messages_worker_flags_id ON messages(worker_id, is_deleted, is_read, id DESC)")
+            c.execute("ANALYZE")
+
+        if version < 6:
+            # numeric worker_id for sorting, indexed per company (VIRTUAL: no storage)
+            c.execute("ALTER TABLE workers ADD COLUMN worker_id_int INTEGER GENERATED ALWAYS AS (CAST(worker_id AS INTEGER)) VIRTUAL")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_workers_company_widint ON workers(company_id, worker_id_int)")
+
+        if version < 7:
+            # every JOIN / login probes workers by worker_id; shifts lookups are covered
+            c.execute("CREATE INDEX IF NOT EXISTS idx_workers_worker_id ON workers(worker_id)")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_shifts_lookup ON shifts(week, company_id, day, time, employee)")
+            c.execute("ANALYZE")
+
+        if version < 8:
+            # one row per (week, company, slot, employee): drop old duplicates, then make the
+            # lookup index UNIQUE as an integrity guard; it also covers the old
+            # (week, company_id) index, so that one goes
+            c.execute("""
+                DELETE FROM shifts WHERE id NOT IN (
+                    SELECT MIN(id) FROM shifts GROUP BY week, company_id, day, time, employee
+                )
+            """)
+            c.execute("DROP INDEX IF EXISTS idx_shifts_lookup")
+            c.execute("CREATE UNIQUE INDEX IF NOT EXISTS uniq_shift ON shifts(week, company_id, day, time, employee)")
+            c.execute("DROP INDEX IF EXISTS idx_shifts_week_company")
 
-    conn.commit()
-    conn.close()
+        c.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.commit()
 
 
 
@@ -300,29 +632,40 @@ def add_worker_form():
 # Utility endpoints
 # =============================================================================
 
+@lru_cache(maxsize=4)
+def _week_dates(start_iso: str) -> tuple:
+    """dd/mm labels for the 7 days starting at the given Sunday (ISO date)."""
+    start = date.fromisoformat(start_iso)
+    return tuple((start + timedelta(days=i)).strftime('%d/%m') for i in range(7))
+
 @app.route('/get_week_dates')
 def get_week_dates():
     week = request.args.get('week', 'current')  # 'current' or 'next'
     today = datetime.now().date()
-    # start from last Sunday (Hebrew week)
+    # start from last Sunday (Hebrew week); keyed by date, so old weeks age out
     start_of_week = today - timedelta(days=(today.weekday() + 1) % 7)
     if week == 'next':
         start_of_week += timedelta(days=7)
-    week_dates = [(start_of_week + timedelta(days=i)).strftime('%d/%m') for i in range(7)]
-    return jsonify(week_dates)
+    return ojson(_week_dates(start_of_week.isoformat()))
 
 @app.route('/debug_constraints')
 def debug_constraints():
-    conn = connect()
-    rows = conn.execute("SELECT * FROM constraints").fetchall()
-    conn.close()
-    return "<br>".join(str(dict(row)) for row in rows)
+    @stream_with_context
+    def rows_html():
+        # stream row by row instead of joining the whole table in memory
+        with get_conn() as conn:
+            for i, row in enumerate(conn.execute("SELECT * FROM constraints")):
+                yield ("<br>" if i else "") + str(dict(row))
+    return Response(rows_html(), mimetype='text/html')
 
 
 # =============================================================================
 # Auth / Register
 # =============================================================================
 
+# checked when the login id doesn't exist, so unknown ids cost the same hash as real ones
+_DUMMY_PASSWORD_HASH = generate_password_hash("no-such-user")
+
 @app.route('/register_manager', methods=['POST'])
 def register_manager():
     data = request.get_json() or {}
@@ -333,34 +676,34 @@ def register_manager():
     if not name or not password or not company_name:
         return jsonify({"success": False, "message": "שם, סיסמה ושם חברה – חובה"}), 400
 
-    conn = connect()
-    c = conn.cursor()
+    password_hash = generate_password_hash(password)  # slow on purpose – not while holding the writer
+    with get_conn(write=True) as conn:
+        c = conn.cursor()
+        c.execute("BEGIN IMMEDIATE")
 
-    # ensure company_id
-    try:
-        c.execute("SELECT company_id FROM companies WHERE company_name = ?", (company_name,))
-        row = c.fetchone()
-        if row:
-            company_id = row[0]
-        else:
-            c.execute("INSERT INTO companies (company_name) VALUES (?)", (company_name,))
-            company_id = c.lastrowid
-    except sqlite3.OperationalError:
-        # fallback if companies table missing
-        max_cid = c.execute("SELECT MAX(COALESCE(company_id,0)) FROM workers").fetchone()[0] or 0
-        company_id = max_cid + 1
+        # ensure company_id
+        try:
+            c.execute("SELECT company_id FROM companies WHERE company_name = ?", (company_name,))
+            row = c.fetchone()
+            if row:
+                company_id = row[0]
+            else:
+                c.execute("INSERT INTO companies (company_name) VALUES (?)", (company_name,))
+                company_id = c.lastrowid
+        except sqlite3.OperationalError:
+            # fallback if companies table missing
+            max_cid = c.execute("SELECT MAX(COALESCE(company_id,0)) FROM workers").fetchone()[0] or 0
+            company_id = max_cid + 1
 
-    # next worker_id
-    max_id = c.execute("SELECT MAX(CAST(worker_id AS INTEGER)) FROM workers").fetchone()[0]
-    new_worker_id = str((int(max_id) if max_id is not None else 9) + 1)
+        # next worker_id
+        new_worker_id = _next_worker_id(c)
 
-    c.execute("""
-        INSERT INTO workers (name, password, role, worker_id, company_id, company_name)
-        VALUES (?, ?, 'manager', ?, ?, ?)
-    """, (name, password, new_worker_id, company_id, company_name))
+        c.execute("""
+            INSERT INTO workers (name, password, role, worker_id, company_id, company_name)
+            VALUES (?, ?, 'manager', ?, ?, ?)
+        """, (name, password_hash, new_worker_id, company_id, company_name))
 
-    conn.commit()
-    conn.close()
+        conn.commit()
 
     return jsonify({
         "success": True,
@@ -379,17 +722,13 @@ def login_manager():
     if not worker_id or not password:
         return jsonify(success=False, message='חסרים פרטים'), 400
 
-    conn = connect()
-    c = conn.cursor()
-    c.execute("""
-        SELECT worker_id, name, company_id, company_name
-        FROM workers
-        WHERE worker_id = ? AND password = ? AND role = 'manager'
-    """, (worker_id, password))
-    row = c.fetchone()
-    conn.close()
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute(_SQL_LOGIN_MANAGER, (worker_id,))
+        row = c.fetchone()
 
-    if not row:
+    password_ok = check_password_hash((row[4] or '') if row else _DUMMY_PASSWORD_HASH, password)
+    if not row or not password_ok:
         return jsonify(success=False, message="פרטי התחברות שגויים"), 401
 
     session['manager_id'] = row[0]
@@ -414,22 +753,18 @@ def login_worker():
     if not worker_id or not password:
         return jsonify(success=False, message='חסרים פרטים'), 400
 
-    conn = connect()
-    c = conn.cursor()
-    # allow only role='worker'
-    c.execute("""
-        SELECT password, company_id, company_name, name
-        FROM workers
-        WHERE worker_id = ? AND role = 'worker'
-    """, (worker_id,))
-    row = c.fetchone()
-    conn.close()
+    with get_conn() as conn:
+        c = conn.cursor()
+        # allow only role='worker'
+        c.execute(_SQL_LOGIN_WORKER, (worker_id,))
+        row = c.fetchone()
 
+    password_ok = check_password_hash((row[0] or '') if row else _DUMMY_PASSWORD_HASH, password)
     if not row:
         return jsonify({"success": False, "message": "לא נמצא עובד עם מזהה זה"}), 404
 
     db_password, company_id, company_name, worker_name = row
-    if db_password != password:
+    if not password_ok:
         return jsonify({"success": False, "message": "סיסמה שגויה"}), 401
 
     return jsonify({
@@ -463,34 +798,35 @@ def add_worker():
     if not company_id:
         return jsonify({"message": "חסרים פרטי חברה. התחבר/י מחדש או שלח/י company_id ו company_name בבקשה."}), 400
 
-    conn = connect()
-    c = conn.cursor()
+    password_hash = generate_password_hash(password)  # slow on purpose – not while holding the writer
+    with get_conn(write=True) as conn:
+        c = conn.cursor()
+        c.execute("BEGIN IMMEDIATE")
+
+        # A logged-in manager's company is already in the session (set at login);
+        # only look it up when the session lacks it
+        manager_id = session.get('manager_id')
+        if manager_id and 'company_id' not in session:
+            c.execute("""
+                SELECT company_id, company_name
+                FROM workers
+                WHERE worker_id = ? AND role = 'manager'
+                LIMIT 1
+            """, (manager_id,))
+            row = c.fetchone()
+            if row:
+                company_id, company_name = row[0], row[1]
+
+        # next worker_id
+        new_worker_id = _next_worker_id(c)
 
-    # If a manager is logged in, trust their company data
-    manager_id = session.get('manager_id')
-    if manager_id:
         c.execute("""
-            SELECT company_id, company_name
-            FROM workers
-            WHERE worker_id = ? AND role = 'manager'
-            LIMIT 1
-        """, (manager_id,))
-        row = c.fetchone()
-        if row:
-            company_id, company_name = row[0], row[1]
-
-    # next worker_id
-    max_id = c.execute("SELECT MAX(CAST(worker_id AS INTEGER)) FROM workers").fetchone()[0]
-    new_worker_id = str((int(max_id) if max_id is not None else 9) + 1)
-
-    c.execute("""
-        INSERT INTO workers
-            (name, password, role, worker_id, id_number, phone, email, company_id, company_name)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (name, password, role, new_worker_id, id_number, phone, email, str(company_id), company_name))
+            INSERT INTO workers
+                (name, password, role, worker_id, id_number, phone, email, company_id, company_name)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (name, password_hash, role, new_worker_id, id_number, phone, email, str(company_id), company_name))
 
-    conn.commit()
-    conn.close()
+        conn.commit()
 
     return jsonify({
         "message": f"{'מנהל' if role=='manager' else 'עובד'} נוסף בהצלחה",
@@ -504,39 +840,23 @@ def add_worker():
 def get_workers():
     cid = get_company_id_from_request()
     if not cid:
-        return jsonify([]), 200
-
-    conn = connect()
-    c = conn.cursor()
-    c.execute("""
-        SELECT worker_id, name, role, id_number, phone, email, company_id
-        FROM workers
-        WHERE company_id = ?
-        ORDER BY CAST(worker_id AS INTEGER)
-    """, (cid,))
-    rows = c.fetchall()
-    conn.close()
-
-    return jsonify([
-        {
-            "worker_id": r["worker_id"],
-            "name": r["name"],
-            "role": r["role"],
-            "id_number": r["id_number"],
-            "phone": r["phone"],
-            "email": r["email"],
-            "company_id": r["company_id"],
-        } for r in rows
-    ])
+        return ojson([])
+
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute(_SQL_GET_WORKERS, (cid,))
+        rows = c.fetchall()
+
+    return ojson([dict(r) for r in rows])
 
 
 @app.route('/delete_worker/<worker_id>', methods=['DELETE'])
 def delete_worker(worker_id):
-    conn = connect()
-    c = conn.cursor()
-    c.execute("DELETE FROM workers WHERE worker_id = ?", (worker_id,))
-    conn.commit()
-    conn.close()
+    with get_conn(write=True) as conn:
+        c = conn.cursor()
+        c.execute("DELETE FROM workers WHERE worker_id = ?", (worker_id,))
+        conn.commit()
+    _get_company_id_for_manager.cache_clear()
     return jsonify({"message": f"עובד עם מזהה {worker_id} נמחק בהצלחה"})
 
 
@@ -550,11 +870,10 @@ def update_worker_field():
     if field not in ['id_number', 'phone', 'email']:
         return jsonify({"error": "Invalid field"}), 400
 
-    conn = connect()
-    c = conn.cursor()
-    c.execute(f"UPDATE workers SET {field} = ? WHERE worker_id = ?", (value, worker_id))
-    conn.commit()
-    conn.close()
+    with get_conn(write=True) as conn:
+        c = conn.cursor()
+        c.execute(f"UPDATE workers SET {field} = ? WHERE worker_id = ?", (value, worker_id))
+        conn.commit()
     return jsonify({"message": "עודכן בהצלחה"})
 
 
@@ -572,14 +891,13 @@ def send_message():
         return jsonify({'success': False, 'message': 'שדות חסרים'}), 400
 
     try:
-        conn = connect()
-        c = conn.cursor()
-        c.execute("""
-            INSERT INTO messages (worker_id, content, timestamp, is_read, is_deleted)
-            VALUES (?, ?, datetime('now', 'localtime'), 0, 0)
-        """, (worker_id, content))
-        conn.commit()
-        conn.close()
+        with get_conn(write=True) as conn:
+            c = conn.cursor()
+            c.execute("""
+                INSERT INTO messages (worker_id, content, timestamp, is_read, is_deleted)
+                VALUES (?, ?, datetime('now', 'localtime'), 0, 0)
+            """, (worker_id, content))
+            conn.commit()
         return jsonify({'success': True})
     except sqlite3.IntegrityError:
         return jsonify({'success': False, 'message': 'שגיאה בשליחה למסד הנתונים'}), 500
@@ -590,105 +908,97 @@ def get_messages():
     company_id = request.args.get('company_id')
     show = (request.args.get('show') or 'unread').lower()  # 'unread' or 'all'
 
-    conn = connect()
-    c = conn.cursor()
+    with get_conn() as conn:
+        rows = conn.execute(
+            _SQL_GET_MESSAGES_COMPANY if company_id else _SQL_GET_MESSAGES_ALL,
+            {"cid": company_id, "all": 1 if show == 'all' else 0}
+        ).fetchall()
 
-    base_sql = """
-        SELECT m.id, m.worker_id, m.content, m.timestamp, w.name, m.is_read, m.is_deleted
-        FROM messages m
-        LEFT JOIN workers w ON m.worker_id = w.worker_id
-    """
-    where, params = [], []
-
-    if company_id:
-        where.append("w.company_id = ?")
-        params.append(company_id)
-    where.append("m.is_deleted = 0")
-    if show != 'all':
-        where.append("m.is_read = 0")
-
-    if where:
-        base_sql += " WHERE " + " AND ".join(where)
-    base_sql += " ORDER BY m.timestamp DESC"
-
-    rows = c.execute(base_sql, params).fetchall()
-    conn.close()
-
-    return jsonify([
-        {
-            "id": r[0],
-            "worker_id": r[1],
-            "content": r[2],
-            "timestamp": r[3],
-            "name": r[4] or "לא ידוע",
-            "is_read": bool(r[5]),
-            "is_deleted": bool(r[6]),
-        } for r in rows
+    return ojson([
+        dict(r, is_read=bool(r["is_read"]), is_deleted=bool(r["is_deleted"]))
+        for r in rows
     ])
 
 
 @app.route('/get_messages_by_worker/<worker_id>')
 def get_messages_by_worker(worker_id):
     include_deleted = request.args.get('include_deleted', '0') == '1'
-    conn = connect()
-    c = conn.cursor()
-    if include_deleted:
-        c.execute("""
-            SELECT id, worker_id, content, timestamp,
-                   COALESCE(is_read, 0), COALESCE(is_deleted, 0)
-            FROM messages
-            WHERE worker_id = ?
-            ORDER BY datetime(timestamp) DESC
-        """, (worker_id,))
-    else:
-        c.execute("""
-            SELECT id, worker_id, content, timestamp,
-                   COALESCE(is_read, 0), COALESCE(is_deleted, 0)
-            FROM messages
-            WHERE worker_id = ? AND COALESCE(is_deleted, 0) = 0
-            ORDER BY datetime(timestamp) DESC
-        """, (worker_id,))
-    rows = c.fetchall()
-    conn.close()
-
-    return jsonify([
-        {
-            "id": r[0],
-            "worker_id": r[1],
-            "content": r[2],
-            "timestamp": r[3],
-            "is_read": bool(r[4]),
-            "is_deleted": bool(r[5]),
-        } for r in rows
+    with get_conn() as conn:
+        c = conn.cursor()
+        if include_deleted:
+            c.execute("""
+                SELECT id, worker_id, content, timestamp,
+                       COALESCE(is_read, 0) AS is_read, COALESCE(is_deleted, 0) AS is_deleted
+                FROM messages
+                WHERE worker_id = ?
+                ORDER BY id DESC
+            """, (worker_id,))
+        else:
+            c.execute("""
+                SELECT id, worker_id, content, timestamp,
+                       COALESCE(is_read, 0) AS is_read, COALESCE(is_deleted, 0) AS is_deleted
+                FROM messages
+                WHERE worker_id = ? AND COALESCE(is_deleted, 0) = 0
+                ORDER BY id DESC
+            """, (worker_id,))
+        rows = c.fetchall()
+
+    return ojson([
+        dict(r, is_read=bool(r["is_read"]), is_deleted=bool(r["is_deleted"]))
+        for r in rows
     ])
 
 
 @app.route('/get_my_messages/<worker_id>')
 def get_my_messages(worker_id):
-    conn = connect()
-    rows = conn.execute("""
-        SELECT id, content, timestamp
-        FROM messages
-        WHERE worker_id = ? AND is_read = 0 AND is_deleted = 0
-        ORDER BY timestamp DESC
-    """, (worker_id,)).fetchall()
-    conn.close()
-    return jsonify([{'id': r[0], 'content': r[1], 'timestamp': r[2]} for r in rows])
+    with get_conn() as conn:
+        rows = conn.execute(_SQL_GET_MY_MESSAGES, (worker_id,)).fetchall()
+    return ojson([dict(r) for r in rows])
 
 @app.route('/mark_message_read/<int:message_id>', methods=['POST'])
 def mark_message_read(message_id):
-    conn = connect()
-    conn.execute("UPDATE messages SET is_read = 1 WHERE id = ?", (message_id,))
-    conn.commit()
-    conn.close()
+    with get_conn(write=True) as conn:
+        conn.execute("UPDATE messages SET is_read = 1 WHERE id = ?", (message_id,))
+        conn.commit()
     return jsonify({'success': True})
 
 @app.route('/delete_message/<int:message_id>', methods=['DELETE'])
 def delete_message(message_id):
-    conn = connect()
-    conn.execute("UPDATE messages SET is_deleted = 1 WHERE id = ?", (message_id,))
-    conn.commit()
-    conn.close()
+    with get_conn(write=True) as conn:
+        conn.execute("UPDATE messages SET is_deleted = 1 WHERE id = ?", (message_id,))
+        conn.commit()
+    return jsonify({'success': True})
+
+def _message_ids_from_request():
+    """The JSON body's "ids" as a list of ints, or None if missing/invalid."""
+    ids = (request.get_json(silent=True) or {}).get('ids')
+    if not isinstance(ids, list) or not ids:
+        return None
+    try:
+        return [int(i) for i in ids]
+    except (TypeError, ValueError):
+        return None
+
+@app.route('/mark_messages_read', methods=['POST'])
+def mark_messages_read():
+    """Batch version of mark_message_read: {"ids": [...]} in one transaction."""
+    ids = _message_ids_from_request()
+    if ids is None:
+        return jsonify({'success': False, 'message': 'חסרה רשימת ids'}), 400
+    with get_conn(write=True) as conn:
+        conn.execute(f"UPDATE messages SET is_read = 1 WHERE id IN ({','.join('?' * len(ids))})", ids)
+        conn.commit()
+    return jsonify({'success': True})
+
+@app.route('/delete_messages', methods=['POST'])
+def delete_messages():
+    """Batch version of delete_message (soft delete): {"ids": [...]}."""
+    ids = _message_ids_from_request()
+    if ids is None:
+        return jsonify({'success': False, 'message': 'חסרה רשימת ids'}), 400
+    with get_conn(write=True) as conn:
+        conn.execute(f"UPDATE messages SET is_deleted = 1 WHERE id IN ({','.join('?' * len(ids))})", ids)
+        conn.commit()
     return jsonify({'success': True})
 
 
@@ -696,51 +1006,29 @@ def delete_message(message_id):
 # Attendance
 # =============================================================================
 
+@cached(TTLCache(maxsize=64, ttl=2), lock=threading.Lock())
+def _attendance_rows(cid):
+    """Attendance of one company (or all when cid is None), cached for 2s.
+
+    Cleared by check_in / check_out so a worker's own punch shows up at once.
+    """
+    with get_conn() as conn:
+        if cid is None:
+            rows = conn.execute(_SQL_GET_ATTENDANCE_ALL).fetchall()
+        else:
+            rows = conn.execute(_SQL_GET_ATTENDANCE_COMPANY, (cid,)).fetchall()
+    return [dict(r) for r in rows]
+
 @app.route('/all_attendance')
 def all_attendance():
-    company_id = request.args.get('company_id')
-    conn = connect()
-    c = conn.cursor()
-    if company_id:
-        c.execute("""
-            SELECT a.worker_id, w.name, a.check_in, a.check_out
-            FROM attendance a
-            JOIN workers w ON a.worker_id = w.worker_id
-            WHERE w.company_id = ?
-            ORDER BY a.check_in DESC
-        """, (company_id,))
-    else:
-        c.execute("""
-            SELECT a.worker_id, w.name, a.check_in, a.check_out
-            FROM attendance a
-            JOIN workers w ON a.worker_id = w.worker_id
-            ORDER BY a.check_in DESC
-        """)
-    data = c.fetchall()
-    conn.close()
-    return jsonify([
-        {"worker_id": row[0], "name": row[1], "check_in": row[2], "check_out": row[3]}
-        for row in data
-    ])
+    return ojson(_attendance_rows(request.args.get('company_id') or None))
 
 @app.route('/get_attendance')
 def get_attendance():
     cid = get_company_id_from_request()
     if not cid:
-        return jsonify([]), 200
-    conn = connect()
-    rows = conn.execute('''
-        SELECT w.worker_id, w.name, a.check_in, a.check_out
-        FROM attendance a
-        JOIN workers w ON a.worker_id = w.worker_id
-        WHERE w.company_id = ?
-        ORDER BY a.check_in DESC
-    ''', (cid,)).fetchall()
-    conn.close()
-    return jsonify([
-        {'worker_id': r[0], 'name': r[1], 'check_in': r[2], 'check_out': r[3]}
-        for r in rows
-    ])
+        return ojson([])
+    return ojson(_attendance_rows(cid))
 
 @app.route('/check_in', methods=['POST'])
 def check_in():
@@ -748,11 +1036,10 @@ def check_in():
     worker_id = data.get("worker_id")
     if not worker_id:
         return jsonify({"message": "חסר worker_id"}), 400
-    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    conn = connect()
-    conn.execute("INSERT INTO attendance (worker_id, check_in) VALUES (?, ?)", (worker_id, now))
-    conn.commit()
-    conn.close()
+    with get_conn(write=True) as conn:
+        now = conn.execute(_SQL_CHECK_IN, (worker_id,)).fetchone()[0]
+        conn.commit()
+    _attendance_rows.cache_clear()
     return jsonify({"message": "התחלת המשמרת בשעה: " + now})
 
 @app.route('/check_out', methods=['POST'])
@@ -761,33 +1048,21 @@ def check_out():
     worker_id = data.get('worker_id')
     if not worker_id:
         return jsonify({"message": "חסר worker_id"}), 400
-    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-    conn = connect()
-    c = conn.cursor()
-    c.execute("""
-        SELECT id FROM attendance
-        WHERE worker_id = ? AND check_out IS NULL
-        ORDER BY check_in DESC LIMIT 1
-    """, (worker_id,))
-    row = c.fetchone()
-
-    if row:
-        c.execute("UPDATE attendance SET check_out = ? WHERE id = ?", (now, row[0]))
+    with get_conn(write=True) as conn:
+        row = conn.execute(_SQL_CHECK_OUT, (worker_id,)).fetchone()
         conn.commit()
-        conn.close()
-        return jsonify({"message": "יציאה נרשמה בהצלחה!"})
-    else:
-        conn.close()
+    _attendance_rows.cache_clear()
+
+    if not row:
         return jsonify({"message": "לא נמצאה משמרת פתוחה!"}), 400
+    return jsonify({"message": "יציאה נרשמה בהצלחה!"})
 
 
 @app.route('/my_shifts/<worker_id>')
 def get_my_shifts(worker_id):
-    conn = connect()
-    rows = conn.execute("SELECT check_in, check_out FROM attendance WHERE worker_id = ?", (worker_id,)).fetchall()
-    conn.close()
-    return jsonify([{"check_in": r[0], "check_out": r[1]} for r in rows])
+    with get_conn() as conn:
+        rows = conn.execute(_SQL_MY_SHIFTS, (worker_id,)).fetchall()
+    return ojson([dict(r) for r in rows])
 
 
 # =============================================================================
@@ -803,105 +1078,82 @@ def submit_constraints():
     if not worker_id:
         return jsonify({"message": "חסר מזהה עובד"}), 400
 
-    conn = connect()
-    c = conn.cursor()
-    c.execute("DELETE FROM constraints WHERE worker_id = ?", (worker_id,))
-    for item in constraints:
-        c.execute(
+    with get_conn(write=True) as conn:
+        c = conn.cursor()
+        c.execute("BEGIN IMMEDIATE")
+        c.execute("DELETE FROM constraints WHERE worker_id = ?", (worker_id,))
+        c.executemany(
             "INSERT INTO constraints (worker_id, day, time) VALUES (?, ?, ?)",
-            (worker_id, item['day'], item['time'])
+            [(worker_id, item['day'], item['time']) for item in constraints]
         )
-    conn.commit()
-    conn.close()
+        conn.commit()
     return jsonify({"message": "האילוצים נשמרו בהצלחה!"})
 
 @app.route('/view_constraints', methods=['GET'])
 def view_constraints():
     company_id = request.args.get('company_id')
-    conn = connect()
-    c = conn.cursor()
-    if company_id:
-        c.execute("""
-            SELECT c.worker_id, w.name, c.day, c.time
-            FROM constraints c
-            JOIN workers w ON c.worker_id = w.worker_id
-            WHERE w.company_id = ?
-        """, (company_id,))
-    else:
-        c.execute("""
-            SELECT c.worker_id, w.name, c.day, c.time
-            FROM constraints c
-            JOIN workers w ON c.worker_id = w.worker_id
-        """)
-    rows = c.fetchall()
-    conn.close()
-    return jsonify([{"worker_id": r[0], "name": r[1], "day": r[2], "time": r[3]} for r in rows])
+    with get_conn() as conn:
+        c = conn.cursor()
+        if company_id:
+            c.execute("""
+                SELECT c.worker_id, w.name, c.day, c.time
+                FROM constraints c
+                JOIN workers w ON c.worker_id = w.worker_id
+                WHERE w.company_id = ?
+            """, (company_id,))
+        else:
+            c.execute("""
+                SELECT c.worker_id, w.name, c.day, c.time
+                FROM constraints c
+                JOIN workers w ON c.worker_id = w.worker_id
+            """)
+        rows = c.fetchall()
+    return ojson([dict(r) for r in rows])
 
 @app.route('/api/view_constraints')
 def view_constraints_api():
     cid = get_company_id_from_request()
     if not cid:
-        return jsonify([]), 200
-
-    conn = connect()
-    rows = conn.execute("""
-        SELECT c.worker_id, w.name, c.day, c.time
-        FROM constraints AS c
-        JOIN workers    AS w ON c.worker_id = w.worker_id
-        WHERE w.company_id = ?
-    """, (cid,)).fetchall()
-    conn.close()
+        return ojson([])
 
-    day_order  = ['ראשון', 'שני', 'שלישי', 'רביעי', 'חמישי', 'שישי', 'שבת']
-    time_order = ['בוקר', 'צהריים', 'ערב', 'לילה']
+    with get_conn() as conn:
+        rows = conn.execute(_SQL_VIEW_CONSTRAINTS, (cid,)).fetchall()
 
-    def sort_key(r):
-        d_idx = day_order.index(r[2]) if r[2] in day_order else 999
-        t_idx = time_order.index(r[3]) if r[3] in time_order else 999
-        return (d_idx, t_idx, r[1])
-
-    rows = sorted(rows, key=sort_key)
-    return jsonify([{"worker_id": r[0], "name": r[1], "day": r[2], "time": r[3]} for r in rows])
+    return ojson([dict(r) for r in rows])
 
 @app.route('/edit_constraints')
 def edit_constraints():
     company_id = request.args.get('company_id')
-    conn = connect()
-    c = conn.cursor()
+    with get_conn() as conn:
+        c = conn.cursor()
 
-    if company_id:
-        c.execute("""
-            SELECT c.rowid, c.worker_id, w.name, c.day, c.time
-            FROM constraints AS c
-            JOIN workers    AS w ON c.worker_id = w.worker_id
-            WHERE w.company_id = ?
-            ORDER BY c.day, c.time, w.name
-        """, (company_id,))
-    else:
-        c.execute("""
-            SELECT c.rowid, c.worker_id, w.name, c.day, c.time
-            FROM constraints AS c
-            JOIN workers    AS w ON c.worker_id = w.worker_id
-            ORDER BY c.day, c.time, w.name
-        """)
+        if company_id:
+            c.execute("""
+                SELECT c.rowid AS rowid, c.worker_id, w.name, c.day, c.time
+                FROM constraints AS c
+                JOIN workers    AS w ON c.worker_id = w.worker_id
+                WHERE w.company_id = ?
+                ORDER BY c.day, c.time, w.name
+            """, (company_id,))
+        else:
+            c.execute("""
+                SELECT c.rowid AS rowid, c.worker_id, w.name, c.day, c.time
+                FROM constraints AS c
+                JOIN workers    AS w ON c.worker_id = w.worker_id
+                ORDER BY c.day, c.time, w.name
+            """)
 
-    rows = c.fetchall()
-    conn.close()
+        rows = c.fetchall()
 
-    constraints = [
-        {"rowid": r[0], "worker_id": r[1], "name": r[2], "day": r[3], "time": r[4]}
-        for r in rows
-    ]
-    return render_template("edit_constraints.html", constraints=constraints)
+    return render_template("edit_constraints.html", constraints=[dict(r) for r in rows])
 
 @app.route('/delete_constraint', methods=['POST'])
 def delete_constraint():
     rowid = request.form.get("rowid")
     if rowid:
-        conn = connect()
-        conn.execute("DELETE FROM constraints WHERE rowid = ?", (rowid,))
-        conn.commit()
-        conn.close()
+        with get_conn(write=True) as conn:
+            conn.execute("DELETE FROM constraints WHERE rowid = ?", (rowid,))
+            conn.commit()
     return redirect("/edit_constraints")
 
 
@@ -914,22 +1166,10 @@ def view_schedule_api():
     cid = get_company_id_from_request()
     week = request.args.get('week', 'current')
     if not cid:
-        return jsonify([])
+        return ojson([])
 
-    conn = connect()
-    rows = conn.execute("""
-        SELECT s.employee, w.name, s.day, s.time
-        FROM shifts s
-        JOIN workers w ON s.employee = w.worker_id
-        WHERE s.week = ? AND s.company_id = ?
-    """, (week, cid)).fetchall()
-    conn.close()
-
-    day_order = ['ראשון','שני','שלישי','רביעי','חמישי','שישי','שבת']
-    time_order = ['בוקר','צהריים','ערב','לילה']
-    rows = sorted(rows, key=lambda x: (day_order.index(x[2]), time_order.index(x[3])))
-
-    return jsonify([{"worker_id":r[0], "name":r[1], "day":r[2], "time":r[3]} for r in rows])
+    with get_conn() as conn:
+        return ojson([dict(r) for r in conn.execute(_SQL_VIEW_SCHEDULE, (week, cid))])
 
 @app.route('/generate_schedule', methods=['POST'])
 def generate_schedule():
@@ -938,62 +1178,54 @@ def generate_schedule():
     if not company_id:
         return jsonify({"message": "חסר company_id (נסו להתחבר מחדש / להעביר ?company_id=)"}), 400
 
-    conn = connect()
-    c = conn.cursor()
+    with get_conn() as conn:
+        c = conn.cursor()
+
+        # company workers
+        c.execute(_SQL_COMPANY_WORKER_IDS, (company_id,))
+        employees = [r[0] for r in c.fetchall()]
+        if not employees:
+            return jsonify({"message": "אין עובדים לשיבוץ עבור החברה הזו"}), 400
+
+        # shift types (dynamic) – fallback defaults
+        try:
+            c.execute("SELECT name FROM shift_types ORDER BY id")
+            time_slots = [row[0] for row in c.fetchall()] or TIME_ORDER
+        except sqlite3.OperationalError:
+            time_slots = TIME_ORDER
 
-    # company workers
-    c.execute("""
-        SELECT worker_id
-        FROM workers
-        WHERE role = 'worker' AND company_id = ?
-    """, (company_id,))
-    employees = [r[0] for r in c.fetchall()]
-    if not employees:
-        conn.close()
-        return jsonify({"message": "אין עובדים לשיבוץ עבור החברה הזו"}), 400
+        # constraints for this company
+        c.execute(_SQL_COMPANY_CONSTRAINTS, (company_id,))
+        unavailable = [(row[0], row[1], row[2]) for row in c.fetchall()]
 
-    days = ['ראשון', 'שני', 'שלישי', 'רביעי', 'חמישי', 'שישי', 'שבת']
+        # warm start: 'next' builds on the current week, a rerun on its own last result
+        c.execute(_SQL_WEEK_SHIFTS, ('current' if week == 'next' else week, company_id))
+        hints = [(row[0], row[1], row[2]) for row in c.fetchall()]
 
-    # shift types (dynamic) – fallback defaults
+    # solve without holding the writer
+    # coverage: 2 for morning/noon, 1 for others; same soft cap for every worker
     try:
-        c.execute("SELECT name FROM shift_types ORDER BY id")
-        time_slots = [row[0] for row in c.fetchall()] or ['בוקר', 'צהריים', 'ערב', 'לילה']
-    except sqlite3.OperationalError:
-        time_slots = ['בוקר', 'צהריים', 'ערב', 'לילה']
-
-    # constraints for this company
-    c.execute("""
-        SELECT c.worker_id, c.day, c.time
-        FROM constraints AS c
-        JOIN workers    AS w ON c.worker_id = w.worker_id
-        WHERE w.company_id = ?
-    """, (company_id,))
-    unavailable = [(row[0], row[1], row[2]) for row in c.fetchall()]
-
-    # coverage: 2 for morning/noon, 1 for others
-    heavier = {'בוקר', 'צהריים'}
-    coverage = {(d, t): (2 if t in heavier else 1) for d in days for t in time_slots}
-
-    # soft max shifts per worker
-    max_shifts = {e: 20 for e in employees}
-
-    schedule = solve_shift_schedule(employees, days, time_slots, unavailable, coverage, max_shifts)
+        schedule = solve_shift_schedule(employees, DAY_ORDER, time_slots, unavailable,
+                                        lambda d, t: 2 if t in HEAVY_SLOTS else 1,
+                                        MAX_SHIFTS_PER_WEEK, hints)
+    except SolverTimeout:
+        return jsonify({"message": "חישוב השיבוץ חרג מהזמן המותר – נסו שוב או הקלו את האילוצים"}), 503
     if not schedule:
-        conn.close()
         return jsonify({"message": "לא ניתן ליצור שיבוץ עם האילוצים הנתונים"}), 400
 
-    # replace existing rows for this week+company
-    c.execute("DELETE FROM shifts WHERE week = ? AND company_id = ?", (week, company_id))
-    schedule_data = []
-    for e, d, t in schedule:
-        c.execute(
-            "INSERT INTO shifts (day, time, employee, week, company_id) VALUES (?, ?, ?, ?, ?)",
-            (d, t, e, week, company_id)
-        )
-        schedule_data.append({"employee": e, "day": d, "time": t, "week": week, "company_id": company_id})
+    with get_conn(write=True) as conn:
+        c = conn.cursor()
+        # replace existing rows for this week+company (the DELETE drops assignments the new
+        # schedule no longer has; it's an index range delete on uniq_shift)
+        c.execute("BEGIN IMMEDIATE")
+        c.execute(_SQL_DELETE_WEEK_SHIFTS, (week, company_id))
+        c.executemany(_SQL_INSERT_SHIFT, [(d, t, e, week, company_id) for e, d, t in schedule])
+        conn.commit()
 
-    conn.commit()
-    conn.close()
+    schedule_data = [
+        {"employee": e, "day": d, "time": t, "week": week, "company_id": company_id}
+        for e, d, t in schedule
+    ]
     return jsonify({"message": f"שיבוץ {week} נוצר בהצלחה!", "schedule": schedule_data}), 201
 
 
@@ -1002,36 +1234,34 @@ def save_schedule():
     """Legacy generic save (kept; not used by your UI)."""
     data = request.get_json() or {}
     schedule = data.get('schedule', [])
-    conn = connect()
-    c = conn.cursor()
-    c.execute("DELETE FROM shifts")
-    for item in schedule:
-        c.execute("INSERT INTO shifts (day, time, employee) VALUES (?, ?, ?)",
-                  (item['day'], item['time'], item['employee']))
-    conn.commit()
-    conn.close()
+    with get_conn(write=True) as conn:
+        c = conn.cursor()
+        c.execute("BEGIN IMMEDIATE")
+        c.execute("DELETE FROM shifts")
+        c.executemany(
+            "INSERT INTO shifts (day, time, employee) VALUES (?, ?, ?)",
+            [(item['day'], item['time'], item['employee']) for item in schedule]
+        )
+        conn.commit()
     return jsonify({"message": "השיבוץ נשמר בהצלחה!"})
 
 @app.route('/load_schedule', methods=['GET'])
 def load_schedule():
-    conn = connect()
-    rows = conn.execute("SELECT day, time, employee FROM shifts").fetchall()
-    conn.close()
-    return jsonify([{"day": r[0], "time": r[1], "employee": r[2]} for r in rows])
+    with get_conn() as conn:
+        # iterate the cursor directly – no intermediate fetchall() list
+        return ojson([dict(r) for r in conn.execute("SELECT day, time, employee FROM shifts")])
 
 @app.route('/export_schedule')
 def export_schedule():
     """Export schedule to Excel filtered by week and company (if provided)."""
     week = request.args.get('week')
-    company_id = request.args.get('company_id') or (
-        session.get('manager_id') and _get_company_id_for_manager(session.get('manager_id'))
-    )
+    mgr = session.get('manager_id')
+    company_id = request.args.get('company_id') or (mgr and _get_company_id_for_manager(mgr))
     export_format = request.args.get('format', 'excel').lower()
     if export_format != 'excel':
         return jsonify({"message": "פורמט לא נתמך. אפשרי: excel"}), 400
 
-    conn = connect()
-    try:
+    with get_conn() as conn:
         sql = """
             SELECT
                 s.employee,
@@ -1054,26 +1284,21 @@ def export_schedule():
             sql += " WHERE " + " AND ".join(where)
         sql += " ORDER BY s.week, s.day, s.time, s.employee"
 
-        df = pd.read_sql_query(sql, conn, params=params)
-    finally:
-        conn.close()
-
-    # ensure columns
-    expected_cols = ['employee', 'employee_name', 'day', 'time', 'week', 'company_id']
-    for col in expected_cols:
-        if col not in df.columns:
-            df[col] = ""
-    df = df[expected_cols]
-
-    filename = "_".join([
-        "schedule",
-        f"company_{company_id}" if company_id else "company_all",
-        f"week_{week}" if week else "week_all"
-    ]) + ".xlsx"
-
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine="openpyxl") as writer:
-        df.to_excel(writer, sheet_name="Schedule", index=False)
+        filename = "_".join([
+            "schedule",
+            f"company_{company_id}" if company_id else "company_all",
+            f"week_{week}" if week else "week_all"
+        ]) + ".xlsx"
+
+        # stream cursor rows straight into the sheet; constant_memory spools finished rows
+        # to a temp file (xlsxwriter turns it off when in_memory is set, so leave that out)
+        output = io.BytesIO()
+        wb = xlsxwriter.Workbook(output, {"constant_memory": True})
+        ws = wb.add_worksheet("Schedule")
+        ws.write_row(0, 0, ['employee', 'employee_name', 'day', 'time', 'week', 'company_id'])
+        for i, row in enumerate(conn.execute(sql, params), 1):
+            ws.write_row(i, 0, row)
+        wb.close()
     output.seek(0)
 
     return send_file(
@@ -1090,10 +1315,8 @@ def export_schedule():
 
 @app.route('/get_shift_types', methods=['GET'])
 def get_shift_types():
-    conn = connect()
-    rows = conn.execute("SELECT id, name FROM shift_types").fetchall()
-    conn.close()
-    return jsonify([{"id": r[0], "name": r[1]} for r in rows])
+    with get_conn() as conn:
+        return ojson([dict(r) for r in conn.execute("SELECT id, name FROM shift_types")])
 
 @app.route('/add_shift_type', methods=['POST'])
 def add_shift_type():
@@ -1101,18 +1324,16 @@ def add_shift_type():
     name = data.get('name')
     if not name:
         return jsonify({"error": "Missing shift name"}), 400
-    conn = connect()
-    conn.execute("INSERT INTO shift_types (name) VALUES (?)", (name,))
-    conn.commit()
-    conn.close()
+    with get_conn(write=True) as conn:
+        conn.execute("INSERT INTO shift_types (name) VALUES (?)", (name,))
+        conn.commit()
     return jsonify({"message": "Shift type added successfully"})
 
 @app.route('/delete_shift_type/<int:shift_id>', methods=['DELETE'])
 def delete_shift_type(shift_id):
-    conn = connect()
-    conn.execute("DELETE FROM shift_types WHERE id = ?", (shift_id,))
-    conn.commit()
-    conn.close()
+    with get_conn(write=True) as conn:
+        conn.execute("DELETE FROM shift_types WHERE id = ?", (shift_id,))
+        conn.commit()
     return jsonify({"message": "Shift type deleted successfully"})
 
 
@@ -1121,6 +1342,4 @@ def delete_shift_type(shift_id):
 # =============================================================================
 
 if __name__ == '__main__':
-    init_db()
-    upgrade_db()
-    app.run(debug=True, port=5050)
+    app.run(debug=True, port=5050)  # init_db/upgrade_db run on the first DB access
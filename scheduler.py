@@ -1,44 +1,73 @@
 from ortools.sat.python import cp_model
 
-def solve_shift_schedule(employees, days, time_slots, unavailable, coverage, max_shifts):
+SOLVE_TIME_LIMIT = 10.0  # seconds; a hard/infeasible week must not hang the request
+
+
+class SolverTimeout(Exception):
+    """CP-SAT hit SOLVE_TIME_LIMIT before finding a schedule or proving there is none."""
+
+
+def solve_shift_schedule(employees, days, time_slots, unavailable, coverage, max_shifts, hints=()):
+    # coverage(d, t) -> workers needed in that slot; max_shifts: weekly cap per worker
+    # hints: (e, d, t) assignments from an earlier schedule, used to warm-start the search
+    # returns the (e, d, t) list, None if infeasible; raises SolverTimeout on the time limit
     model = cp_model.CpModel()
     X = {}
 
-    # Define variables
+    # Define variables – unavailable (e, d, t) get no variable at all.
+    # The same pass fills the per-slot / per-employee / per-day lists the constraints sum over.
+    unavail_set = set(unavailable)
+    by_slot = {(d, t): [] for d in days for t in time_slots}
+    by_emp = {e: [] for e in employees}
+    by_day = {(e, d): [] for e in employees for d in days}
     for e in employees:
         for d in days:
             for t in time_slots:
-                X[(e, d, t)] = model.NewBoolVar(f'X_{e}_{d}_{t}')
-
-    # Unavailability
-    for (e, d, t) in unavailable:
-        model.Add(X[(e, d, t)] == 0)
+                if (e, d, t) not in unavail_set:
+                    x = X[(e, d, t)] = model.NewBoolVar(f'X_{e}_{d}_{t}')
+                    by_slot[(d, t)].append(x)
+                    by_emp[e].append(x)
+                    by_day[(e, d)].append(x)
 
     # Shift coverage
-    for d in days:
-        for t in time_slots:
-            model.Add(sum(X[(e, d, t)] for e in employees) == coverage[(d, t)])
+    for (d, t), slot in by_slot.items():
+        need = coverage(d, t)
+        if len(slot) < need:
+            return None  # not enough available workers for this slot
+        if need == 1:
+            model.AddExactlyOne(slot)
+        else:
+            model.Add(cp_model.LinearExpr.Sum(slot) == need)
 
     # Max shifts per week
-    for e in employees:
-        model.Add(sum(X[(e, d, t)] for d in days for t in time_slots) <= max_shifts[e])
+    for shifts in by_emp.values():
+        model.Add(cp_model.LinearExpr.Sum(shifts) <= max_shifts)
 
     # ❗ Add: One shift per day per employee
-    for e in employees:
-        for d in days:
-            model.Add(sum(X[(e, d, t)] for t in time_slots) <= 1)
+    for day_vars in by_day.values():
+        model.AddAtMostOne(day_vars)
+
+    # Warm start – hints for pruned/unknown slots are skipped
+    for key in hints:
+        if key in X:
+            model.AddHint(X[key], 1)
 
     # Solve
+    # feasibility only (no objective): parallel search, stop at the first solution
     solver = cp_model.CpSolver()
+    solver.parameters.num_workers = 8
+    solver.parameters.stop_after_first_solution = True
+    solver.parameters.cp_model_presolve = True
+    solver.parameters.log_search_progress = False
+    solver.parameters.max_time_in_seconds = SOLVE_TIME_LIMIT
     status = solver.Solve(model)
 
-    if status in [cp_model.FEASIBLE, cp_model.OPTIMAL]:
-        result = [
-            (e, d, t)
-            for e in employees
-            for d in days
-            for t in time_slots
-            if solver.Value(X[(e, d, t)]) == 1
-        ]
+    if status == cp_model.UNKNOWN:
+        raise SolverTimeout()
+    if status in (cp_model.FEASIBLE, cp_model.OPTIMAL):
+        # one read of the solution vector instead of a solver.Value() call per variable;
+        # X keeps (e, d, t) insertion order, so the result order is unchanged
+        solution = list(solver.ResponseProto().solution)
+        result = [key for key, var in X.items() if solution[var.Index()]]
         return result
     return None
\ No newline at end of file